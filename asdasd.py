@@ -1,13 +1,18 @@
 import streamlit as st
 import os
-import subprocess
-import sys
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 from PIL import Image
 from io import BytesIO
-import tempfile
 import shutil
 import json
 from datetime import datetime
+from google import genai
+from google.genai import types
+from google.genai import errors as genai_errors
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 # Page configuration
 st.set_page_config(
@@ -16,28 +21,26 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize session state
-if 'step_prompts' not in st.session_state:
-    st.session_state.step_prompts = {
-        "step1": "Generate ONLY a very light, minimal pencil sketch that captures the basic shapes and main contours from the original image. The lines should be extremely light and loose, just enough to guide the watercolor painting. This is typical watercolor preparation - barely visible guidelines on white watercolor paper.",
-        
-        "step2": "Create the first watercolor wash using very light, transparent colors. 1. Apply broad, light washes of the main color areas from the original image. 2. Use wet-on-wet technique - colors should blend and flow naturally. 3. Keep all colors very light and transparent - this is just the base layer. 4. Leave white paper areas for the lightest highlights completely untouched. 5. Use the light sketch as a guide but let the watercolor flow naturally beyond the lines. 6. Focus on establishing the basic color temperature and mood.",
-        
-        "step3": "Add a second layer of watercolor washes to build up color intensity. 1. Use the first wash as your foundation - work on DRY paper for more control. 2. Add slightly stronger, but still transparent colors in the medium-tone areas. 3. Begin to define shapes more clearly while maintaining watercolor's flowing quality. 4. Continue to preserve white paper highlights - once painted over, they cannot be recovered. 5. Use wet-on-dry technique for more defined edges where needed. 6. Layer transparent colors to create depth and richness.",
-        
-        "step4": "Build up medium tone values with careful watercolor layering. 1. Work from the previous wash layer, adding medium-strength transparent colors. 2. Begin to establish form and volume through careful value control. 3. Use a combination of wet-on-dry for controlled edges and wet-on-wet for soft transitions. 4. Maintain the luminosity characteristic of watercolor - avoid muddy colors. 5. Continue protecting white areas and light tones established in previous layers.",
-        
-        "step5": "Develop the shadow areas with stronger, but still transparent watercolor layers. 1. Build on the previous medium tone layer without losing its transparency. 2. Add deeper, richer colors in the shadow areas using multiple transparent glazes. 3. Maintain the wet, flowing quality of watercolor while gaining more control over shapes. 4. Use color temperature variations - warm and cool colors to create depth. 5. Allow some colors to blend naturally while controlling others with wet-on-dry technique.",
-        
-        "step6": "Add details and texture while maintaining watercolor's characteristic transparency. 1. Work from the shadow layer, adding carefully controlled details. 2. Use fine brushwork for details but keep the overall watercolor aesthetic. 3. Add texture through varied brushstrokes and controlled color bleeding. 4. Maintain the balance between detail and the loose, flowing quality of watercolor. 5. Use both wet-on-wet for soft details and wet-on-dry for crisp edges where appropriate.",
-        
-        "step7": "Add the deepest, darkest values to complete the tonal range of the watercolor painting. 1. Build from the detailed layer, adding only the very darkest shadow areas. 2. Use rich, concentrated watercolor pigments but maintain transparency. 3. These darks should be painted with confidence in single, decisive strokes. 4. Ensure the darkest values provide proper contrast with the preserved white highlights. 5. Maintain the luminous quality that makes watercolor distinctive.",
-        
-        "step8": "Complete the watercolor painting with final touches and refinements. 1. Build from the previous layer, making only subtle final adjustments. 2. Add any final small details or accents that enhance the overall composition. 3. Ensure the full range of values from pure white paper to deep darks is present. 4. Maintain the characteristic transparency, luminosity, and flowing quality of watercolor. 5. The finished painting should capture the spontaneous, fresh quality that makes watercolor unique. 6. Preserve the white of the paper for highlights - this is what gives watercolor its luminous quality."
-    }
-
-if 'system_prompt' not in st.session_state:
-    st.session_state.system_prompt = """You are an expert watercolor painting generator that creates step-by-step paintings from photographs.
+# Default prompts live at module level so reruns don't rebuild the big strings
+DEFAULT_STEP_PROMPTS = {
+    "step1": "Generate ONLY a very light, minimal pencil sketch that captures the basic shapes and main contours from the original image. The lines should be extremely light and loose, just enough to guide the watercolor painting. This is typical watercolor preparation - barely visible guidelines on white watercolor paper.",
+
+    "step2": "Create the first watercolor wash using very light, transparent colors. 1. Apply broad, light washes of the main color areas from the original image. 2. Use wet-on-wet technique - colors should blend and flow naturally. 3. Keep all colors very light and transparent - this is just the base layer. 4. Leave white paper areas for the lightest highlights completely untouched. 5. Use the light sketch as a guide but let the watercolor flow naturally beyond the lines. 6. Focus on establishing the basic color temperature and mood.",
+
+    "step3": "Add a second layer of watercolor washes to build up color intensity. 1. Use the first wash as your foundation - work on DRY paper for more control. 2. Add slightly stronger, but still transparent colors in the medium-tone areas. 3. Begin to define shapes more clearly while maintaining watercolor's flowing quality. 4. Continue to preserve white paper highlights - once painted over, they cannot be recovered. 5. Use wet-on-dry technique for more defined edges where needed. 6. Layer transparent colors to create depth and richness.",
+
+    "step4": "Build up medium tone values with careful watercolor layering. 1. Work from the previous wash layer, adding medium-strength transparent colors. 2. Begin to establish form and volume through careful value control. 3. Use a combination of wet-on-dry for controlled edges and wet-on-wet for soft transitions. 4. Maintain the luminosity characteristic of watercolor - avoid muddy colors. 5. Continue protecting white areas and light tones established in previous layers.",
+
+    "step5": "Develop the shadow areas with stronger, but still transparent watercolor layers. 1. Build on the previous medium tone layer without losing its transparency. 2. Add deeper, richer colors in the shadow areas using multiple transparent glazes. 3. Maintain the wet, flowing quality of watercolor while gaining more control over shapes. 4. Use color temperature variations - warm and cool colors to create depth. 5. Allow some colors to blend naturally while controlling others with wet-on-dry technique.",
+
+    "step6": "Add details and texture while maintaining watercolor's characteristic transparency. 1. Work from the shadow layer, adding carefully controlled details. 2. Use fine brushwork for details but keep the overall watercolor aesthetic. 3. Add texture through varied brushstrokes and controlled color bleeding. 4. Maintain the balance between detail and the loose, flowing quality of watercolor. 5. Use both wet-on-wet for soft details and wet-on-dry for crisp edges where appropriate.",
+
+    "step7": "Add the deepest, darkest values to complete the tonal range of the watercolor painting. 1. Build from the detailed layer, adding only the very darkest shadow areas. 2. Use rich, concentrated watercolor pigments but maintain transparency. 3. These darks should be painted with confidence in single, decisive strokes. 4. Ensure the darkest values provide proper contrast with the preserved white highlights. 5. Maintain the luminous quality that makes watercolor distinctive.",
+
+    "step8": "Complete the watercolor painting with final touches and refinements. 1. Build from the previous layer, making only subtle final adjustments. 2. Add any final small details or accents that enhance the overall composition. 3. Ensure the full range of values from pure white paper to deep darks is present. 4. Maintain the characteristic transparency, luminosity, and flowing quality of watercolor. 5. The finished painting should capture the spontaneous, fresh quality that makes watercolor unique. 6. Preserve the white of the paper for highlights - this is what gives watercolor its luminous quality."
+}
+
+DEFAULT_SYSTEM_PROMPT = """You are an expert watercolor painting generator that creates step-by-step paintings from photographs.
 CRITICAL RULES YOU MUST ALWAYS FOLLOW:
 1. NEVER add any objects, people, or elements that are not present in the original image
 2. ALWAYS maintain the EXACT same composition as the reference images
@@ -48,305 +51,289 @@ CRITICAL RULES YOU MUST ALWAYS FOLLOW:
 7. Maintain white paper for highlights - watercolor cannot add white paint
 8. Use proper watercolor color mixing and bleeding effects"""
 
-def create_modified_script(api_key, image_path, system_prompt, step_prompts, output_dir):
-    """Create a modified version of the watercolor script with custom prompts"""
-    
-    script_content = f'''import os
-from PIL import Image
-from io import BytesIO
-from google import genai
-from google.genai import types
+# Initialize session state from the frozen defaults on first access only
+st.session_state.setdefault("step_prompts", dict(DEFAULT_STEP_PROMPTS))
+st.session_state.setdefault("system_prompt", DEFAULT_SYSTEM_PROMPT)
+
+# The 8-step workflow: (prompt key, output filename, display title, use previous layer)
+STEPS = [
+    ("step1", "step1_light_sketch.jpg", "Step 1: Light Pencil Sketch", False),
+    ("step2", "step2_first_wash.jpg", "Step 2: First Light Wash", True),
+    ("step3", "step3_second_wash.jpg", "Step 3: Second Wash - Building Color", True),
+    ("step4", "step4_medium_tones.jpg", "Step 4: Medium Tones", True),
+    ("step5", "step5_shadows.jpg", "Step 5: Developing Shadows", True),
+    ("step6", "step6_details.jpg", "Step 6: Adding Details and Texture", True),
+    ("step7", "step7_darkest_values.jpg", "Step 7: Deepest Darks", True),
+    ("step8", "step8_finished_watercolor.jpg", "Step 8: Finished Watercolor Painting", True),
+]
+
+# Read-only display titles, built once instead of per rerun
+STEP_NAMES = tuple(title for _, _, title, _ in STEPS)
+
+# Steps drafted speculatively alongside the preceding step, from the same inputs.
+# Only step 2 qualifies: its prompt calls the sketch an optional guide, whereas
+# step 8 must build on step 7's darkest-values layer
+SPECULATIVE_STEPS = {1}
+
+# Cap on concurrent Gemini requests so speculative steps don't trip rate limits
+GEMINI_CONCURRENCY = 2
+
+# Transient API errors worth retrying instead of failing the whole run
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
 
-# --- Configuration and Setup ---
-client = genai.Client(api_key="{api_key}")
+def is_retryable_error(exc):
+    if isinstance(exc, genai_errors.APIError):
+        return exc.code in RETRYABLE_STATUS_CODES
+    # httpx is the genai SDK's transport; its timeouts don't subclass the builtin
+    return isinstance(exc, (TimeoutError, httpx.TimeoutException))
 
-IMAGE_PATH = '{image_path}'
-OUTPUT_DIR = '{output_dir}'
+# On-disk cache of generated step images, persisted across Streamlit runs
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "watercolor")
 
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
-    print(f"Created directory: {{OUTPUT_DIR}}")
+def step_cache_key(base_image_bytes, system_prompt, step_prompts, step_num):
+    """Content hash covering the input image and every prompt up to this step"""
+    hasher = hashlib.sha256(base_image_bytes)
+    hasher.update(system_prompt.encode("utf-8"))
+    for n in range(1, step_num + 1):
+        hasher.update(step_prompts[f"step{n}"].encode("utf-8"))
+    return hasher.hexdigest()
 
-try:
-    original_image = Image.open(IMAGE_PATH)
-    print(f"Loaded original image from {{IMAGE_PATH}}")
-except FileNotFoundError:
-    print(f"Error: The image file at '{{IMAGE_PATH}}' was not found.")
-    exit()
+@st.cache_data
+def compute_cache_keys(base_image_bytes, system_prompt, step_prompts):
+    """Hash the full prompt config once per unique (image, prompts) combination"""
+    return [
+        step_cache_key(base_image_bytes, system_prompt, step_prompts, n)
+        for n in range(1, 9)
+    ]
 
-SYSTEM_PROMPT = """{system_prompt}"""
+def get_client(api_key):
+    """Fresh genai.Client per pipeline run, shared by all 8 steps of that run.
 
-def call_gemini_with_context(client, system_prompt, user_prompt, images, output_path, step_name):
+    The SDK's pooled connections bind to the event loop they were created on,
+    and each Generate click drives the pipeline through its own asyncio.run
+    loop - a client cached across clicks would fail with a closed-loop error
+    on the second run.
+    """
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(timeout=180_000)  # milliseconds
+    )
+
+@retry(
+    retry=retry_if_exception(is_retryable_error),
+    wait=wait_exponential_jitter(initial=1, max=30),
+    stop=stop_after_attempt(5),
+    reraise=True
+)
+async def generate_with_retry(client, contents):
+    """Single Gemini call, retried with jittered backoff on transient errors"""
+    return await client.aio.models.generate_content(
+        model="gemini-2.0-flash-preview-image-generation",
+        contents=contents,
+        config=types.GenerateContentConfig(
+            response_modalities=['TEXT', 'IMAGE']
+        )
+    )
+
+async def call_gemini_with_context(client, system_prompt, user_prompt, images, step_name, semaphore, cache_key=None):
     try:
-        print(f"\\n--- Generating {{step_name}} ---")
-        complete_prompt = f"{{system_prompt}}\\n\\n{{user_prompt}}"
-        
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-preview-image-generation",
-            contents=[complete_prompt] + images,
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE']
+        # Cache hit skips the Gemini call entirely
+        cache_path = os.path.join(CACHE_DIR, f"{cache_key}.jpg") if cache_key else None
+        if cache_path and os.path.exists(cache_path):
+            return Image.open(cache_path)
+
+        complete_prompt = f"{system_prompt}\n\n{user_prompt}"
+
+        async with semaphore:
+            response = await generate_with_retry(
+                client,
+                contents=[complete_prompt] + images
             )
-        )
-        
+
         if response and response.candidates and response.candidates[0].content:
             for part in response.candidates[0].content.parts:
                 if part.inline_data:
                     generated_image = Image.open(BytesIO(part.inline_data.data))
-                    generated_image.save(output_path)
-                    print(f"{{step_name}} saved to: {{output_path}}")
-                    return output_path, generated_image
-        
-        print(f"Could not find image data in the response for {{output_path}}.")
-        return None, None
+                    if cache_path:
+                        os.makedirs(CACHE_DIR, exist_ok=True)
+                        tmp_path = cache_path + ".tmp"
+                        generated_image.save(tmp_path, format="JPEG")
+                        os.replace(tmp_path, cache_path)
+                    return generated_image
+
+        st.warning(f"Could not find image data in the response for {step_name}.")
+        return None
     except Exception as e:
-        print(f"Error generating image for {{step_name}}: {{e}}")
-        return None, None
+        st.warning(f"Error generating image for {step_name}: {e}")
+        return None
 
-if __name__ == "__main__":
-    base_image = original_image
-    
-    # Step 1: Light Pencil Sketch
-    step1_prompt = """{step_prompts['step1']}"""
-    step1_path = os.path.join(OUTPUT_DIR, "step1_light_sketch.jpg")
-    step1_path, light_sketch_image = call_gemini_with_context(
-        client, SYSTEM_PROMPT, step1_prompt, [base_image], 
-        step1_path, "Step 1: Light Pencil Sketch"
-    )
-    if not step1_path or not light_sketch_image:
-        print("Could not generate light sketch. Exiting.")
-        exit()
-    
-    # Step 2: First Light Wash
-    step2_prompt = """{step_prompts['step2']}"""
-    step2_path = os.path.join(OUTPUT_DIR, "step2_first_wash.jpg")
-    step2_path, first_wash_image = call_gemini_with_context(
-        client, SYSTEM_PROMPT, step2_prompt, [base_image, light_sketch_image], 
-        step2_path, "Step 2: First Light Wash"
-    )
-    if not step2_path or not first_wash_image:
-        print("Could not generate first wash. Exiting.")
-        exit()
-    
-    # Step 3: Second Wash
-    step3_prompt = """{step_prompts['step3']}"""
-    step3_path = os.path.join(OUTPUT_DIR, "step3_second_wash.jpg")
-    step3_path, second_wash_image = call_gemini_with_context(
-        client, SYSTEM_PROMPT, step3_prompt, [base_image, first_wash_image], 
-        step3_path, "Step 3: Second Wash - Building Color"
-    )
-    if not step3_path or not second_wash_image:
-        print("Could not generate second wash. Exiting.")
-        exit()
-    
-    # Step 4: Medium Tones
-    step4_prompt = """{step_prompts['step4']}"""
-    step4_path = os.path.join(OUTPUT_DIR, "step4_medium_tones.jpg")
-    step4_path, medium_tones_image = call_gemini_with_context(
-        client, SYSTEM_PROMPT, step4_prompt, [base_image, second_wash_image], 
-        step4_path, "Step 4: Medium Tones"
-    )
-    if not step4_path or not medium_tones_image:
-        print("Could not generate medium tones. Exiting.")
-        exit()
-    
-    # Step 5: Shadows
-    step5_prompt = """{step_prompts['step5']}"""
-    step5_path = os.path.join(OUTPUT_DIR, "step5_shadows.jpg")
-    step5_path, shadows_image = call_gemini_with_context(
-        client, SYSTEM_PROMPT, step5_prompt, [base_image, medium_tones_image], 
-        step5_path, "Step 5: Developing Shadows"
-    )
-    if not step5_path or not shadows_image:
-        print("Could not generate shadows. Exiting.")
-        exit()
-    
-    # Step 6: Details
-    step6_prompt = """{step_prompts['step6']}"""
-    step6_path = os.path.join(OUTPUT_DIR, "step6_details.jpg")
-    step6_path, details_image = call_gemini_with_context(
-        client, SYSTEM_PROMPT, step6_prompt, [base_image, shadows_image], 
-        step6_path, "Step 6: Adding Details and Texture"
-    )
-    if not step6_path or not details_image:
-        print("Could not generate details. Exiting.")
-        exit()
-    
-    # Step 7: Darkest Values
-    step7_prompt = """{step_prompts['step7']}"""
-    step7_path = os.path.join(OUTPUT_DIR, "step7_darkest_values.jpg")
-    step7_path, darkest_values_image = call_gemini_with_context(
-        client, SYSTEM_PROMPT, step7_prompt, [base_image, details_image], 
-        step7_path, "Step 7: Deepest Darks"
-    )
-    if not step7_path or not darkest_values_image:
-        print("Could not generate darkest values. Exiting.")
-        exit()
-    
-    # Step 8: Finished Painting
-    step8_prompt = """{step_prompts['step8']}"""
-    step8_path = os.path.join(OUTPUT_DIR, "step8_finished_watercolor.jpg")
-    step8_path, finished_image = call_gemini_with_context(
-        client, SYSTEM_PROMPT, step8_prompt, [base_image, darkest_values_image], 
-        step8_path, "Step 8: Finished Watercolor Painting"
+async def run_watercolor_pipeline(client, system_prompt, step_prompts, base_image, progress_cb):
+    """Run the 8-step watercolor workflow in-process, reporting each step via progress_cb"""
+
+    semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+    # One cache key per step, covering the input image and all upstream prompts
+    base_buf = BytesIO()
+    base_image.save(base_buf, format="JPEG")
+    cache_keys = compute_cache_keys(base_buf.getvalue(), system_prompt, step_prompts)
+
+    prev = None
+    i = 0
+    while i < len(STEPS):
+        _, _, _, use_prev = STEPS[i]
+        images = [base_image] + ([prev] if use_prev and prev is not None else [])
+
+        # A speculative step runs concurrently with its leader from the same inputs
+        indices = [i]
+        if i + 1 in SPECULATIVE_STEPS:
+            indices.append(i + 1)
+
+        tasks = [
+            asyncio.create_task(call_gemini_with_context(
+                client, system_prompt, step_prompts[STEPS[idx][0]], images,
+                STEPS[idx][2], semaphore, cache_key=cache_keys[idx]
+            ))
+            for idx in indices
+        ]
+        generated = await asyncio.gather(*tasks)
+
+        for idx, image in zip(indices, generated):
+            title = STEPS[idx][2]
+            if image is None:
+                st.error(f"Could not generate {title}.")
+                return False
+            progress_cb(idx, title, image)
+            prev = image
+        i += len(indices)
+
+    return True
+
+@st.fragment
+def prompts_panel():
+    """Prompt editors as a fragment - edits rerun only this panel, not the whole app"""
+    st.header("📝 System Prompt")
+    st.session_state.system_prompt = st.text_area(
+        "System Prompt",
+        value=st.session_state.system_prompt,
+        height=200,
+        help="This is the main instruction that guides the AI's behavior"
     )
-    if not step8_path or not finished_image:
-        print("Could not generate finished watercolor painting. Exiting.")
-        exit()
-    
-    print(f"\\nWatercolor workflow completed. Check the '{{OUTPUT_DIR}}' folder for all generated watercolor painting steps.")
-'''
-    
-    return script_content
+
+    st.header("🎯 Step Prompts")
+
+    for step_key, step_name in zip(st.session_state.step_prompts.keys(), STEP_NAMES):
+        with st.expander(step_name, expanded=False):
+            st.session_state.step_prompts[step_key] = st.text_area(
+                f"Prompt for {step_name}",
+                value=st.session_state.step_prompts[step_key],
+                height=150,
+                key=f"prompt_{step_key}"
+            )
 
 def main():
     st.title("🎨 Watercolor Step-by-Step Generator")
     st.markdown("Generate beautiful watercolor paintings step-by-step using AI")
-    
+
     # Sidebar for configuration
     with st.sidebar:
         st.header("Configuration")
-        
+
         # API Key input
         api_key = st.text_input("Gemini API Key", type="password", help="Enter your Google Gemini API key")
-        
+
         # Image upload
         uploaded_file = st.file_uploader("Upload Image", type=['jpg', 'jpeg', 'png'])
-        
+
         if uploaded_file is not None:
             st.image(uploaded_file, caption="Input Image", width=200)
-    
+
     # Main content area
     col1, col2 = st.columns([1, 1])
-    
+
     with col1:
-        st.header("📝 System Prompt")
-        st.session_state.system_prompt = st.text_area(
-            "System Prompt", 
-            value=st.session_state.system_prompt,
-            height=200,
-            help="This is the main instruction that guides the AI's behavior"
-        )
-        
-        st.header("🎯 Step Prompts")
-        
-        step_names = [
-            "Step 1: Light Pencil Sketch",
-            "Step 2: First Light Wash", 
-            "Step 3: Second Wash - Building Color",
-            "Step 4: Medium Tones",
-            "Step 5: Developing Shadows",
-            "Step 6: Adding Details and Texture",
-            "Step 7: Deepest Darks",
-            "Step 8: Finished Watercolor Painting"
-        ]
-        
-        for i, (step_key, step_name) in enumerate(zip(st.session_state.step_prompts.keys(), step_names)):
-            with st.expander(step_name, expanded=False):
-                st.session_state.step_prompts[step_key] = st.text_area(
-                    f"Prompt for {step_name}",
-                    value=st.session_state.step_prompts[step_key],
-                    height=150,
-                    key=f"prompt_{step_key}"
-                )
-    
+        prompts_panel()
+
     with col2:
         st.header("🚀 Generate Watercolor")
-        
+
         if st.button("Generate Watercolor Steps", type="primary", disabled=not (api_key and uploaded_file)):
             if not api_key:
                 st.error("Please enter your Gemini API key")
             elif not uploaded_file:
                 st.error("Please upload an image")
             else:
-                # Create temporary directories
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    # Save uploaded image
-                    image_path = os.path.join(temp_dir, "input_image.jpg")
-                    with open(image_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    
-                    # Create output directory
-                    output_dir = os.path.join(temp_dir, "output")
-                    
-                    # Create modified script
-                    script_content = create_modified_script(
-                        api_key, image_path, st.session_state.system_prompt, 
-                        st.session_state.step_prompts, output_dir
-                    )
-                    
-                    # Save script
-                    script_path = os.path.join(temp_dir, "watercolor_script.py")
-                    with open(script_path, "w") as f:
-                        f.write(script_content)
-                    
-                    # Run the script
-                    with st.spinner("Generating watercolor steps... This may take several minutes."):
-                        try:
-                            result = subprocess.run(
-                                [sys.executable, script_path],
-                                capture_output=True,
-                                text=True,
-                                timeout=1800  # 30 minutes timeout
-                            )
-                            
-                            if result.returncode == 0:
-                                st.success("Watercolor generation completed!")
-                                
-                                # Display results
-                                st.header("📸 Generated Watercolor Steps")
-                                
-                                step_files = [
-                                    ("step1_light_sketch.jpg", "Step 1: Light Pencil Sketch"),
-                                    ("step2_first_wash.jpg", "Step 2: First Light Wash"),
-                                    ("step3_second_wash.jpg", "Step 3: Second Wash"),
-                                    ("step4_medium_tones.jpg", "Step 4: Medium Tones"),
-                                    ("step5_shadows.jpg", "Step 5: Developing Shadows"),
-                                    ("step6_details.jpg", "Step 6: Adding Details"),
-                                    ("step7_darkest_values.jpg", "Step 7: Deepest Darks"),
-                                    ("step8_finished_watercolor.jpg", "Step 8: Finished Watercolor")
-                                ]
-                                
-                                # Display images in a grid
-                                for i in range(0, len(step_files), 2):
-                                    cols = st.columns(2)
-                                    for j, col in enumerate(cols):
-                                        if i + j < len(step_files):
-                                            filename, title = step_files[i + j]
-                                            image_path = os.path.join(output_dir, filename)
-                                            if os.path.exists(image_path):
-                                                with col:
-                                                    image = Image.open(image_path)
-                                                    st.image(image, caption=title, use_column_width=True)
-                                                    
-                                                    # Add download button
-                                                    with open(image_path, "rb") as file:
-                                                        st.download_button(
-                                                            label=f"Download {title}",
-                                                            data=file.read(),
-                                                            file_name=filename,
-                                                            mime="image/jpeg"
-                                                        )
-                                
-                                # Show console output
-                                with st.expander("Console Output"):
-                                    st.text(result.stdout)
-                                    if result.stderr:
-                                        st.text("Errors:")
-                                        st.text(result.stderr)
-                            
-                            else:
-                                st.error("Script execution failed!")
-                                st.text("Error output:")
-                                st.text(result.stderr)
-                                st.text("Standard output:")
-                                st.text(result.stdout)
-                        
-                        except subprocess.TimeoutExpired:
-                            st.error("Script execution timed out after 30 minutes")
-                        except Exception as e:
-                            st.error(f"An error occurred: {str(e)}")
-        
+                # Decode straight from the upload buffer - no disk round trip -
+                # and downscale once to the model's working resolution; the
+                # full-res photo would otherwise be uploaded 8 times and
+                # downsampled server-side anyway
+                base_image = Image.open(uploaded_file)
+                base_image.thumbnail((1024, 1024), Image.LANCZOS)
+                base_buf = BytesIO()
+                base_image.convert("RGB").save(base_buf, format="JPEG", quality=90)
+                base_image = Image.open(base_buf)
+
+                client = get_client(api_key)
+
+                # Steps stay in memory for this run; JPEG bytes are only
+                # encoded for the download buttons
+                step_images = {}
+
+                step_files = [(filename, title) for _, filename, title, _ in STEPS]
+
+                # Pre-create the results grid so each step streams in as it completes
+                st.header("📸 Generated Watercolor Steps")
+                placeholders = []
+                for i in range(0, len(step_files), 2):
+                    cols = st.columns(2)
+                    for col in cols:
+                        with col:
+                            placeholders.append(st.empty())
+
+                def progress_cb(step_index, title, image):
+                    step_images[title] = image
+                    placeholders[step_index].image(image, caption=title, use_container_width=True)
+
+                # Run the pipeline in-process
+                with st.spinner("Generating watercolor steps... This may take several minutes."):
+                    success = asyncio.run(run_watercolor_pipeline(
+                        client, st.session_state.system_prompt,
+                        st.session_state.step_prompts, base_image,
+                        progress_cb
+                    ))
+
+                if success:
+                    st.success("Watercolor generation completed!")
+
+                    # Encode the download JPEGs in parallel - PIL releases the
+                    # GIL during encode, so the 8 steps overlap on threads
+                    def encode_jpeg(image):
+                        buf = BytesIO()
+                        image.save(buf, format="JPEG")
+                        return buf
+
+                    to_encode = [title for _, title in step_files if title in step_images]
+                    with ThreadPoolExecutor(max_workers=8) as pool:
+                        step_buffers = dict(zip(
+                            to_encode,
+                            pool.map(encode_jpeg, [step_images[t] for t in to_encode])
+                        ))
+
+                    # Re-fill each placeholder with the image plus its download button
+                    for idx, (filename, title) in enumerate(step_files):
+                        image = step_images.get(title)
+                        if image is not None:
+                            with placeholders[idx].container():
+                                st.image(image, caption=title, use_container_width=True)
+                                st.download_button(
+                                    label=f"Download {title}",
+                                    data=step_buffers[title].getvalue(),
+                                    file_name=filename,
+                                    mime="image/jpeg"
+                                )
+
+                else:
+                    st.error("Watercolor generation failed!")
+
         # Instructions
         st.header("📋 Instructions")
         st.markdown("""
@@ -355,10 +342,10 @@ def main():
         3. **Customize the system prompt** to change the overall AI behavior
         4. **Modify step prompts** to customize each watercolor stage
         5. **Click Generate** to create your step-by-step watercolor painting
-        
+
         **Note:** The generation process may take several minutes as it creates 8 different watercolor steps.
         """)
-        
+
         # Sample prompts section
         with st.expander("💡 Sample Prompt Ideas"):
             st.markdown("""
@@ -366,12 +353,12 @@ def main():
             - Focus on skin tones and facial features
             - Emphasize soft, flowing hair textures
             - Preserve highlight areas on nose and cheeks
-            
+
             **For landscapes:**
             - Start with sky washes and distant mountains
             - Build up foreground details gradually
             - Use wet-on-wet for atmospheric effects
-            
+
             **For still life:**
             - Establish basic shapes first
             - Focus on light and shadow relationships
@@ -379,4 +366,4 @@ def main():
             """)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()